@@ -1,7 +1,36 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import orjson
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import Numeric, Date, String, Table
+from sqlalchemy import String, Table
+
+# How long cached API responses stay valid, historical rates of past dates never change
+HIST_RATES_EXPIRE_AFTER = timedelta(days=365)
+CURRENCIES_EXPIRE_AFTER = timedelta(days=1)
+LATEST_RATES_EXPIRE_AFTER = timedelta(hours=1)
+
+RATES_COLUMNS = ("date", "base_currency_code", "target_currency_code", "rate")
+
+
+def _cast_if_needed(df: pd.DataFrame, column: str, dtype):
+    """
+    Casts df[column] to dtype, unless the column already has that dtype.
+    For str, a column only holding strings is kept as it is, whatever its dtype.
+    """
+    if dtype is str:
+        needs_cast = not pd.api.types.is_string_dtype(df[column])
+    else:
+        needs_cast = df[column].dtype != dtype
+    if needs_cast:
+        df[column] = df[column].astype(dtype)
 
 
 class APIProcessor:
@@ -10,35 +39,67 @@ class APIProcessor:
     Provides methods to retrieve currency information and exchange rates.
     """
 
-    def __init__(self, base_url="https://api.vatcomply.com"):
+    def __init__(self, base_url="https://api.vatcomply.com", cache_name=".http_cache"):
         self.base_url = base_url
-
-    def _make_request(self, endpoint: str, params=None):
+        # responses are cached on disk so reruns do not hit the API again
+        self.session = requests_cache.CachedSession(
+            cache_name=cache_name,
+            backend="sqlite",
+            expire_after=HIST_RATES_EXPIRE_AFTER,
+        )
+        # keep-alive connections are reused across calls and worker threads
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.3),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # latest currencies and rates are kept in memory for the lifetime of
+        # this processor, on top of the on-disk cache
+        self._currencies = None
+        self._base_rates = {}
+
+    def _make_request(self, endpoint: str, params=None, expire_after=None):
         """
         Internal helper method to make an API call and handle common error checking.
+        Responses are served from the on-disk cache until expire_after has passed.
         """
         url = f"{self.base_url}{endpoint}"
         try:
-            response = requests.get(url, params=params)
+            response = self.session.get(
+                url, params=params, expire_after=expire_after, timeout=10
+            )
             response.raise_for_status()
-            return response.json()
+            # orjson decodes the float heavy rate tables faster than response.json()
+            return orjson.loads(response.content)
         except requests.exceptions.RequestException as e:
             print(f"Error making API call to {url}: {e}")
             return None
+        except orjson.JSONDecodeError as e:
+            print(f"Error decoding response of API call to {url}: {e}")
+            return None
 
     def _get_currencies(self):
         """
         Makes an API call to /currencies to get a list of all supported currencies.
 
+        The response is memoized, failed calls are not.
+
         Returns:
             dict: A JSON response with all currencies, or None if an error occurs.
         """
-        return self._make_request("/currencies")
+        if self._currencies is None:
+            self._currencies = self._make_request(
+                "/currencies", expire_after=CURRENCIES_EXPIRE_AFTER
+            )
+        return self._currencies
 
     def _get_base_rate(self, base_currency: str):
         """
         Makes an API call to /rates?base={base_currency} to get exchange rates
         relative to a specified base currency.
+        Responses are memoized per base currency, failed calls are not.
 
         Args:
             base_currency (str): The three-letter currency code (e.g., "USD", "EUR").
@@ -47,13 +108,25 @@ class APIProcessor:
             dict: A JSON response with exchange rates, or None if an error occurs.
         """
         # Note: Removed the space after 'base=' from your original URL, as it might cause issues.
-        return self._make_request("/rates", params={"base": base_currency.upper()})
+        base_currency = base_currency.upper()
+        base_rates = self._base_rates.get(base_currency)
+        if base_rates is None:
+            base_rates = self._make_request(
+                "/rates",
+                params={"base": base_currency},
+                expire_after=LATEST_RATES_EXPIRE_AFTER,
+            )
+            if base_rates is not None:
+                self._base_rates[base_currency] = base_rates
+        return base_rates
 
     def _get_historical_rate(self, date: str):
         """
         Makes an API call to /rates?date={date} to get historical exchange rates.
         NOTE: EUR is the base currency for historical rates, and further conversion
         would be required if you need a different base.
+        Only rates of past dates are cached long, until rates for today or a later date
+        are published the API answers with the rates of an earlier date.
 
         Args:
             date (str): The date in 'YYYY-MM-DD' format (e.g., "2023-01-15").
@@ -61,7 +134,13 @@ class APIProcessor:
         Returns:
             dict: A JSON response with historical exchange rates, or None if an error occurs.
         """
-        return self._make_request("/rates", params={"date": date})
+        if pd.Timestamp(date).date() < datetime.now(timezone.utc).date():
+            expire_after = HIST_RATES_EXPIRE_AFTER
+        else:
+            expire_after = LATEST_RATES_EXPIRE_AFTER
+        return self._make_request(
+            "/rates", params={"date": date}, expire_after=expire_after
+        )
 
     def process_currencies(self):
         """
@@ -71,12 +150,17 @@ class APIProcessor:
             pd.DataFrame: a dataframe object with processed data with consistent data format as in DB
         """
         currencies_json = self._get_currencies()
-        df_init = pd.DataFrame.from_dict(currencies_json, orient="index")
-        df_processed = df_init.reset_index().rename(columns={"index": "currency_code"})
-        df_final = df_processed.drop_duplicates(subset=["currency_code"], keep="last")
-        df_final["currency_code"] = df_final["currency_code"].astype(str)
-        df_final["name"] = df_final["name"].astype(str)
-        df_final["symbol"] = df_final["symbol"].astype(str)
+        # one list per column, rather than a row per currency via from_dict
+        # keys of the decoded json are already unique, the last duplicate wins
+        df_final = pd.DataFrame(
+            {
+                "currency_code": list(currencies_json),
+                "name": [currency["name"] for currency in currencies_json.values()],
+                "symbol": [currency["symbol"] for currency in currencies_json.values()],
+            }
+        )
+        for column in ("currency_code", "name", "symbol"):
+            _cast_if_needed(df_final, column, str)
         return df_final
 
     def process_base_rates(self, base_currency: str):
@@ -87,15 +171,15 @@ class APIProcessor:
             pd.DataFrame: a dataframe object with processed data
         """
         base_rates_json = self._get_base_rate(base_currency)
-        date = base_rates_json["date"]
-        df = (
-            pd.DataFrame.from_dict(base_rates_json["rates"], orient="index")
-            .reset_index()
-            .rename(columns={"index": "currency_code", 0: "rate"})
+        rates = base_rates_json["rates"]
+        df = pd.DataFrame(
+            {
+                "currency_code": list(rates),
+                "rate": list(rates.values()),
+                "date": base_rates_json["date"],
+            }
         )
-        df["date"] = date
-        df_final = df.drop_duplicates(subset=["currency_code"], keep="last")
-        return df_final
+        return df
 
     def process_base_rates_NOK(self):
         """
@@ -105,16 +189,29 @@ class APIProcessor:
             pd.DataFrame: a dataframe object with processed data
         """
         base_rates_json = self._get_base_rate("NOK")
-        date = base_rates_json["date"]
-        df = (
-            pd.DataFrame.from_dict(base_rates_json["rates"], orient="index")
-            .reset_index()
-            .rename(columns={"index": "target_currency_code", 0: "rate"})
+        rates = base_rates_json["rates"]
+        df = pd.DataFrame(
+            {
+                "target_currency_code": list(rates),
+                "rate": list(rates.values()),
+                "date": base_rates_json["date"],
+                "base_currency_code": "NOK",
+            }
         )
-        df_final = df.drop_duplicates(subset=["target_currency_code"], keep="last")
-        df_final["date"] = date
-        df_final["base_currency_code"] = "NOK"
-        return df_final
+        return df
+
+    def _get_historical_rates(self, dates, max_workers=8):
+        """
+        Calls _get_historical_rate for all dates concurrently, the worker threads
+        share the session and so its pooled connections.
+
+        Returns:
+            dict: EUR based rates keyed by the rate date of the API response
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            outputs = list(executor.map(self._get_historical_rate, dates))
+        # dates without published rates (e.g. weekends) resolve to the same rate date
+        return {output["date"]: output["rates"] for output in outputs}
 
     def process_hist_rates(self, date: str):
         """
@@ -124,31 +221,95 @@ class APIProcessor:
             pd.DataFrame: a dataframe object with processed data
         """
         output_json = self._get_historical_rate(date)
-        date = output_json["date"]
-        df = (
-            pd.DataFrame.from_dict(output_json["rates"], orient="index")
-            .reset_index()
-            .rename(columns={"index": "currency_code", 0: "rate_EUR"})
+        rates = output_json["rates"]
+        df = pd.DataFrame(
+            {
+                "currency_code": list(rates),
+                "rate_EUR": list(rates.values()),
+                "date": output_json["date"],
+            }
         )
-        df["date"] = date
-        df_processed = df.drop_duplicates(subset=["currency_code"], keep="last")
-        return df_processed
+        return df
+
+    def process_hist_rates_many(self, dates, max_workers=8):
+        """
+        calls _get_historical_rate for all dates concurrently
+        Same columns as process_hist_rates, with the rates of all dates in one dataframe
+
+        Return:
+            pd.DataFrame: a dataframe object with processed data for all dates
+        """
+        rates_by_date = self._get_historical_rates(dates, max_workers=max_workers)
+        df = pd.DataFrame(
+            {
+                "currency_code": [
+                    code for rates in rates_by_date.values() for code in rates
+                ],
+                "rate_EUR": [
+                    rate for rates in rates_by_date.values() for rate in rates.values()
+                ],
+                "date": [date for date, rates in rates_by_date.items() for _ in rates],
+            }
+        )
+        return df
 
     def process_hist_rate_NOK(self, date: str):
         """
-        calls process_hist_rates to receive historical currency conversion rates
-        Calculate rates with NOK as base currency
+        calls _get_historical_rate to receive historical currency conversion rates
+        Calculate rates with NOK as base currency, straight from the API response
+        instead of rebasing a process_hist_rates dataframe
 
         Return:
             pd.DataFrame: a dataframe object with processed data
         """
-        df = self.process_hist_rates(date)
-        df["base_currency_code"] = "NOK"
-        nok_rate_eur = df[df["currency_code"] == "NOK"]["rate_EUR"].iloc[0]
-        df["rate"] = df["rate_EUR"] / nok_rate_eur
-        df_processed = df.drop(columns=["rate_EUR"])
-        df_final = df_processed.rename(
-            columns={"currency_code": "target_currency_code"}
+        output_json = self._get_historical_rate(date)
+        rates = output_json["rates"]
+        nok_rate_eur = rates["NOK"]
+        rates_eur = np.fromiter(rates.values(), dtype=np.float64, count=len(rates))
+        df_final = pd.DataFrame(
+            {
+                "target_currency_code": list(rates),
+                "date": output_json["date"],
+                "base_currency_code": "NOK",
+                "rate": rates_eur / nok_rate_eur,
+            }
+        )
+        return df_final
+
+    def process_hist_rate_NOK_many(self, dates, max_workers=8):
+        """
+        calls _get_historical_rate for all dates concurrently
+        Calculate rates with NOK as base currency for all dates at once, dividing a
+        (dates x currencies) matrix of EUR rates by its NOK column
+
+        Return:
+            pd.DataFrame: a dataframe object with processed data for all dates
+        """
+        rates_by_date = self._get_historical_rates(dates, max_workers=max_workers)
+        if not rates_by_date:
+            return pd.DataFrame(
+                columns=["target_currency_code", "date", "base_currency_code", "rate"]
+            )
+
+        currency_codes = sorted(set().union(*rates_by_date.values()))
+        currency_index = {code: i for i, code in enumerate(currency_codes)}
+        rates_eur = np.full((len(rates_by_date), len(currency_codes)), np.nan)
+        for row, rates in enumerate(rates_by_date.values()):
+            columns = [currency_index[code] for code in rates]
+            rates_eur[row, columns] = list(rates.values())
+        rates_nok = rates_eur / rates_eur[:, [currency_index["NOK"]]]
+
+        # currencies missing on a date are left out
+        date_idx, code_idx = np.nonzero(~np.isnan(rates_nok))
+        currency_codes = np.array(currency_codes, dtype=object)
+        rate_dates = np.array(list(rates_by_date), dtype=object)
+        df_final = pd.DataFrame(
+            {
+                "target_currency_code": currency_codes[code_idx],
+                "date": rate_dates[date_idx],
+                "base_currency_code": "NOK",
+                "rate": rates_nok[date_idx, code_idx],
+            }
         )
         return df_final
 
@@ -160,31 +321,15 @@ def _db_upsert_record_currencies_user_method(table: Table, conn, keys, data_iter
     """
     Upsert record into currency.currencies table
     """
-    pd_dataframe_chunk = pd.DataFrame(list(data_iter), columns=keys)
-    values_to_insert = pd_dataframe_chunk.to_dict(orient="records")
-    insert_stmt = insert(table.table).values(values_to_insert)
+    values_to_insert = [dict(zip(keys, row)) for row in data_iter]
+    insert_stmt = insert(table.table)
 
     on_conflict_stmt = insert_stmt.on_conflict_do_update(
         index_elements=["currency_code"],
         set_={"name": insert_stmt.excluded.name, "symbol": insert_stmt.excluded.symbol},
     )
-    result = conn.execute(on_conflict_stmt)
-    return result.rowcount
-
-
-def _db_upsert_record_rates_user_method(table: Table, conn, keys, data_iter, **kw):
-    """
-    Upsert record into currency.currencies table
-    """
-    pd_dataframe_chunk = pd.DataFrame(list(data_iter), columns=keys)
-    values_to_insert = pd_dataframe_chunk.to_dict(orient="records")
-    insert_stmt = insert(table.table).values(values_to_insert)
-
-    on_conflict_stmt = insert_stmt.on_conflict_do_update(
-        index_elements=["date", "base_currency_code", "target_currency_code"],
-        set_={"rate": insert_stmt.excluded.rate,},
-    )
-    result = conn.execute(on_conflict_stmt)
+    # executemany form, rows are bound as parameters instead of inlined into the SQL
+    result = conn.execute(on_conflict_stmt, values_to_insert)
     return result.rowcount
 
 
@@ -216,27 +361,34 @@ def upsert_currencies_to_db(currencies_df: pd.DataFrame, db_engine):
 
 def upsert_rates_to_db(rates_df: pd.DataFrame, db_engine):
     """
-    Use SQL Alchemy engine doing bulk insert in DB
-    Also uses a custom method for upsert logic
+    Use SQL Alchemy engine doing bulk upsert in DB
+    Rows are streamed with COPY into a temporary staging table,
+    then merged into currency.currency_conversion_rate with one INSERT ... ON CONFLICT
     """
-
-    dtype_mapping = {
-        "target_currency_code": String(3),  # Maps to VARCHAR(3)
-        "base_currency_code": String(3),
-        "rate": Numeric(20, 10),  # Maps to VARCHAR(100)
-        "date": Date,  # Maps to VARCHAR(10)
-    }
-
-    with db_engine.connect() as conn:
-        with conn.begin():
-            rows_affected = rates_df.to_sql(
-                schema="currency",
-                name="currency_conversion_rate",
-                if_exists="append",
-                index=False,
-                method=_db_upsert_record_rates_user_method,
-                dtype=dtype_mapping,
-                con=conn,
-            )
-        print("upsertion in to currency.currency_conversion_rate table completed")
-        print(f"Total rows affected (inserted/updated): {rows_affected}")
+    columns = ", ".join(RATES_COLUMNS)
+    buffer = io.StringIO()
+    rates_df[list(RATES_COLUMNS)].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    create_stage_sql = """
+    CREATE TEMP TABLE currency_conversion_rate_stage
+    (LIKE currency.currency_conversion_rate INCLUDING DEFAULTS) ON COMMIT DROP;
+    """
+    copy_sql = (
+        f"COPY pg_temp.currency_conversion_rate_stage ({columns}) FROM STDIN WITH CSV"
+    )
+    merge_sql = f"""
+    INSERT INTO currency.currency_conversion_rate ({columns})
+    SELECT {columns} FROM pg_temp.currency_conversion_rate_stage
+    ON CONFLICT (date, base_currency_code, target_currency_code) DO UPDATE
+    SET rate = EXCLUDED.rate;
+    """
+    with db_engine.begin() as conn:
+        # COPY is only available on the raw psycopg2 cursor
+        with conn.connection.cursor() as cursor:
+            cursor.execute(create_stage_sql)
+            cursor.copy_expert(copy_sql, buffer)
+            cursor.execute(merge_sql)
+            rows_affected = cursor.rowcount
+    print("upsertion in to currency.currency_conversion_rate table completed")
+    print(f"Total rows affected (inserted/updated): {rows_affected}")
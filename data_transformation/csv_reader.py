@@ -1,18 +1,70 @@
 import os
 import re
-import datetime
-from datetime import timezone
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+_BATCH_RE = re.compile(r"(\d+)\.csv$")
+# sort key of files without a batch number, they go last
+_INF = float("inf")
+
+# Column types for the batch csv files, timestamps are parsed straight to UTC
+CSV_CONVERT_OPTIONS = pacsv.ConvertOptions(
+    column_types={
+        "id": pa.string(),
+        "item": pa.string(),
+        # NUMERIC(5,2) in the DB, float32 round-trips all of its 5 significant digits
+        "price": pa.float32(),
+        "currency": pa.dictionary(pa.int32(), pa.string()),
+        "created_at": pa.timestamp("us", tz="UTC"),
+        "updated_at": pa.timestamp("us", tz="UTC"),
+        "system_timestamp": pa.timestamp("us", tz="UTC"),
+    }
+)
+# Only the columns needed to decide whether a csv file has new rows
+PEEK_CONVERT_OPTIONS = pacsv.ConvertOptions(
+    column_types=CSV_CONVERT_OPTIONS.column_types,
+    include_columns=["updated_at", "system_timestamp"],
+)
+TIMESTAMP_COLUMNS = ("created_at", "updated_at", "system_timestamp")
+
+# Name of the check point row kept in the DB for this processor
+CHECK_POINT_NAME = "item_prices"
+
+
+def _arrow_types_mapper(arrow_type):
+    """Keeps string columns Arrow-backed instead of converting them to Python objects."""
+    if pa.types.is_string(arrow_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def _with_string_timestamps(convert_options):
+    """Returns a copy of convert_options reading the timestamp columns as strings."""
+    column_types = dict(convert_options.column_types)
+    for column in TIMESTAMP_COLUMNS:
+        column_types[column] = pa.string()
+    return pacsv.ConvertOptions(
+        column_types=column_types, include_columns=convert_options.include_columns
+    )
 
 
 class CsvProcessor:
-    def __init__(self, db_connector, related_batch_dir_to_script="../batch_data"):
+    def __init__(
+        self, db_connector, related_batch_dir_to_script="../batch_data", max_workers=4
+    ):
         self.db_connector = db_connector
+        self.max_workers = max_workers
         # calculate absolute path for batch dir
         self.batch_data_dir = os.path.join(
             os.path.dirname(os.path.abspath(__file__)), "../batch_data"
         )
-        self.check_point = datetime.datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        # kept as a UTC Timestamp, the same type as the parsed timestamp columns
+        self.check_point = pd.Timestamp("1970-01-01", tz="UTC")
+        self._check_point_lock = threading.Lock()
         print("csv Processor initialised with batch directory ", self.batch_data_dir)
         print("check point initialised with value : ", self.check_point)
 
@@ -24,67 +76,169 @@ class CsvProcessor:
         Return:
             Integer: batch number
         """
-        match = re.search(r"(\d+)\.csv$", filename)
+        match = _BATCH_RE.search(filename)
         if match:
             return int(match.group(1))
-        return float("inf")
+        return _INF
 
     def _order_csvs(self):
         """
-        order csv files based on batch number, ascending.
+        order csv files in the batch directory based on batch number, ascending.
 
         Return
             List: orderd csv file names
         """
-        csv_file_list = []
-        for csv_file in os.listdir(self.batch_data_dir):
-            csv_file_list.append(csv_file)
-
-        ordered_csvs = sorted(csv_file_list, key=self._get_batch_number)
+        with os.scandir(self.batch_data_dir) as entries:
+            keyed_csvs = [
+                (self._get_batch_number(entry.name), entry.name)
+                for entry in entries
+                if entry.is_file() and entry.name.endswith(".csv")
+            ]
+        # batch numbers are computed once per file, not once per comparison
+        keyed_csvs.sort()
+        ordered_csvs = [csv_file for _, csv_file in keyed_csvs]
 
         return ordered_csvs
 
+    def _read_csv(self, csv: str, convert_options=CSV_CONVERT_OPTIONS):
+        """
+        Reads in a single csv file with the multithreaded pyarrow parser,
+        timestamp columns are parsed as UTC while reading.
+        Timestamps without a zone offset are taken as UTC, like pd.to_datetime(utc=True).
+
+        Return:
+            pd.DataFrame: content of the csv file
+        """
+        path = self.batch_data_dir + "/" + csv
+        try:
+            table = pacsv.read_csv(path, convert_options=convert_options)
+        except pa.ArrowInvalid:
+            # pyarrow only parses timestamps with an offset as UTC, read the timestamps
+            # as text and parse them with pandas, other bad values raise again here
+            table = pacsv.read_csv(
+                path, convert_options=_with_string_timestamps(convert_options)
+            )
+            df = table.to_pandas(
+                split_blocks=True, self_destruct=True, types_mapper=_arrow_types_mapper
+            )
+            for column in TIMESTAMP_COLUMNS:
+                if column in df.columns:
+                    df[column] = pd.to_datetime(
+                        df[column], utc=True, format="ISO8601"
+                    ).astype("datetime64[us, UTC]")
+            return df
+        return table.to_pandas(
+            split_blocks=True, self_destruct=True, types_mapper=_arrow_types_mapper
+        )
+
+    def _peek_csv(self, csv: str):
+        """
+        Reads in only the updated_at and system_timestamp columns of a csv file.
+
+        Return:
+            pd.DataFrame: timestamp columns of the csv file
+        """
+        return self._read_csv(csv, convert_options=PEEK_CONVERT_OPTIONS)
+
+    def _ingest_one(self, csv: str, check_point):
+        """
+        Reads in one csv file, upserts rows with system_timestamp newer than check_point.
+        Runs on a worker thread, so it uses its own DB connection and only touches
+        self.check_point under the lock.
+
+        Return:
+            Boolean: False if the file could not be read or its rows could not be upserted
+        """
+        print(csv, "is processed")
+        try:
+            # the peek only parsed the timestamps, other columns can still be invalid
+            df = self._read_csv(csv)
+        except Exception as e:
+            print(f"An unexpected error occurred when reading {csv} : {e}")
+            return False
+        # compare on the underlying UTC datetime64 buffer rather than per Timestamp
+        check_point = pd.Timestamp(check_point).to_datetime64()
+        df = df.loc[df["system_timestamp"].values > check_point]
+        if df.empty:
+            return True
+        db_connector = self.db_connector.spawn()
+        try:
+            # one transaction, and so one commit, per file
+            db_connector.begin()
+            db_connector.bulk_upsert_item_prices(df)
+            db_connector.commit()
+        except Exception as e:
+            db_connector.rollback()
+            print(f"An unexpected error occurred when upserting data into : {e}")
+            return False
+        finally:
+            db_connector._close()
+        with self._check_point_lock:
+            self.check_point = max(self.check_point, df["system_timestamp"].max())
+        return True
+
+    def load_check_point(self):
+        """
+        Restores the check point saved in the DB by a previous run, if there is one.
+        """
+        check_point = self.db_connector.get_check_point(CHECK_POINT_NAME)
+        if check_point is not None:
+            self.check_point = pd.Timestamp(check_point).tz_convert("UTC")
+        print("check point loaded with value : ", self.check_point)
+
     def process_csvs(self):
         """
         Reads in orderd csvs list and process the files in order.
 
         Checks updated_at record all date in the field, this can be checked against DB and fetched from API
         Use a check point mechanism to only process csv roles with updated system_timestamp
-        Processed data are loaded in price.item_prices table in the DB
+        Processed data are loaded in price.item_prices table in the DB, one bulk upsert per file
+        Files are read and upserted concurrently, each file still only takes rows newer than
+        all files before it, as if they were processed one after another.
+        Files without rows newer than the check point are skipped before being fully parsed,
+        the final check point is saved in the DB. If a file fails to upsert, the check point
+        is kept at that file's cutoff so the file is processed again by the next run.
 
         Return:
             List: A list of date from updated_at column
         """
-        date_list = []
+        dates_per_file = []
         ordered_csvs = self._order_csvs()
-        for csv in ordered_csvs:
-            print(csv, "is processed")
-            df = pd.read_csv(self.batch_data_dir + "/" + csv)
-            df["created_at"] = pd.to_datetime(df["created_at"], utc=True)
-            df["updated_at"] = pd.to_datetime(df["updated_at"], utc=True)
-            df["system_timestamp"] = pd.to_datetime(df["system_timestamp"], utc=True)
-            date_list.extend(df["updated_at"].dt.date.unique())
-            for row_tuple in df.itertuples():
-                if row_tuple.system_timestamp > self.check_point:
-                    try:
-                        self.db_connector.upsert_record_item_prices(
-                            row_tuple.id,
-                            row_tuple.item,
-                            row_tuple.price,
-                            row_tuple.currency,
-                            row_tuple.created_at,
-                            row_tuple.updated_at,
-                            row_tuple.system_timestamp,
-                        )
-                        self.check_point = row_tuple.system_timestamp
-                    except Exception as e:
-                        print(
-                            f"An unexpected error occurred when upserting data into : {e}"
-                        )
-
-                else:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            peeked_dfs = list(executor.map(self._peek_csv, ordered_csvs))
+            csvs_to_ingest = []
+            check_points = []
+            check_point = self.check_point
+            for csv, df in zip(ordered_csvs, peeked_dfs):
+                dates_per_file.append(df["updated_at"].dt.date.unique())
+                # one reduction per file decides both the skip and the next cutoff
+                file_check_point = df["system_timestamp"].max()
+                # NaT when system_timestamp is empty, it must not become the cutoff
+                if (
+                    df.empty
+                    or pd.isna(file_check_point)
+                    or file_check_point <= check_point
+                ):
+                    print(csv, "has no rows newer than the check point, skipped")
                     continue
+                csvs_to_ingest.append(csv)
+                check_points.append(check_point)
+                check_point = file_check_point
+            ingested = list(
+                executor.map(self._ingest_one, csvs_to_ingest, check_points)
+            )
+        failed_check_points = [
+            check_point
+            for check_point, success in zip(check_points, ingested)
+            if not success
+        ]
+        if failed_check_points:
+            # cutoffs ascend with file order, the first failed file has the lowest
+            self.check_point = min(self.check_point, failed_check_points[0])
         print("After processing, check point updated to ", self.check_point)
-        # remove duplicates
-        date_list = sorted(list(set(date_list)))
+        self.db_connector.save_check_point(CHECK_POINT_NAME, self.check_point)
+        if not dates_per_file:
+            return []
+        # remove duplicates across files in one pass
+        date_list = sorted(pd.unique(np.concatenate(dates_per_file)))
         return date_list
@@ -1,6 +1,68 @@
+import io
 import os
+import threading
+import time
 import psycopg2
-from psycopg2 import Error
+from psycopg2 import Error, OperationalError
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+ITEM_PRICES_COLUMNS = (
+    "id",
+    "item",
+    "price",
+    "currency",
+    "created_at",
+    "updated_at",
+    "system_timestamp",
+)
+_ITEM_PRICES_COLUMNS_SQL = ", ".join(ITEM_PRICES_COLUMNS)
+
+# Upsert statements are built once at import time, not on every call.
+# Both upsert paths never let an older system_timestamp overwrite a newer one.
+UPSERT_ITEM_PRICES_SQL = f"""
+INSERT INTO public.item_prices ({_ITEM_PRICES_COLUMNS_SQL})
+VALUES %s
+ON CONFLICT (id) DO UPDATE
+SET
+    item = EXCLUDED.item,
+    price = EXCLUDED.price,
+    currency = EXCLUDED.currency,
+    created_at = EXCLUDED.created_at,
+    updated_at = EXCLUDED.updated_at,
+    system_timestamp = EXCLUDED.system_timestamp
+WHERE public.item_prices.system_timestamp IS NULL
+    OR public.item_prices.system_timestamp <= EXCLUDED.system_timestamp;
+"""
+CREATE_ITEM_PRICES_STAGE_SQL = """
+CREATE TEMP TABLE item_prices_stage
+(LIKE public.item_prices INCLUDING DEFAULTS) ON COMMIT DROP;
+"""
+COPY_ITEM_PRICES_STAGE_SQL = (
+    f"COPY pg_temp.item_prices_stage ({_ITEM_PRICES_COLUMNS_SQL}) FROM STDIN WITH CSV"
+)
+# batches may be merged concurrently: rows are locked in id order to avoid
+# deadlocks and an older system_timestamp never overwrites a newer one
+MERGE_ITEM_PRICES_STAGE_SQL = f"""
+INSERT INTO public.item_prices ({_ITEM_PRICES_COLUMNS_SQL})
+SELECT {_ITEM_PRICES_COLUMNS_SQL} FROM pg_temp.item_prices_stage
+ORDER BY id
+ON CONFLICT (id) DO UPDATE
+SET
+    item = EXCLUDED.item,
+    price = EXCLUDED.price,
+    currency = EXCLUDED.currency,
+    created_at = EXCLUDED.created_at,
+    updated_at = EXCLUDED.updated_at,
+    system_timestamp = EXCLUDED.system_timestamp
+WHERE public.item_prices.system_timestamp IS NULL
+    OR public.item_prices.system_timestamp <= EXCLUDED.system_timestamp;
+"""
+
+# Queries outside a transaction are retried on a fresh connection when the
+# connection is lost, waiting QUERY_RETRY_DELAY seconds, doubled per retry.
+QUERY_ATTEMPTS = 3
+QUERY_RETRY_DELAY = 0.1
 
 
 class DBConnector:
@@ -15,31 +77,69 @@ class DBConnector:
         password="mypassword",
         host="localhost",
         port="5432",
+        max_connections=8,
     ):
         self.dbname = os.getenv("DB_NAME", dbname)
         self.user = os.getenv("DB_USER", user)
         self.password = os.getenv("DB_PASSWORD", password)
         self.host = os.getenv("DB_HOST", host)
         self.port = os.getenv("DB_PORT", port)
+        self.max_connections = max_connections
         self._connection = None
+        self._in_transaction = False
+        # connections come from a pool shared with the connectors returned by spawn()
+        self._pool = None
+        self._owns_pool = False
+        self._pool_lock = threading.Lock()
 
-    def _connect(self):
-        """Establishes a new database connection if one is not already open."""
-        if self._connection is None or self._connection.closed:
-            try:
+    def spawn(self):
+        """
+        Returns a new DBConnector with the same settings and a connection of its own.
+        A connection runs one transaction at a time, so concurrent workers each need one.
+        Its connection is taken from, and returned to, this connector's pool.
+        """
+        connector = DBConnector(
+            dbname=self.dbname,
+            user=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port,
+            max_connections=self.max_connections,
+        )
+        connector._pool = self._get_pool()
+        return connector
+
+    def _get_pool(self):
+        """Creates the connection pool on first use."""
+        with self._pool_lock:
+            if self._pool is None or self._pool.closed:
                 print(
                     f"Connecting to PostgreSQL database: {self.dbname} on {self.host}:{self.port}"
                 )
-                self._connection = psycopg2.connect(
+                self._pool = ThreadedConnectionPool(
+                    1,
+                    self.max_connections,
                     dbname=self.dbname,
                     user=self.user,
                     password=self.password,
                     host=self.host,
                     port=self.port,
                 )
-                # Set autocommit to True for simpler operations.
-                # For complex transactions, you might set this to False and manage commit/rollback manually.
-                self._connection.autocommit = True
+                self._owns_pool = True
+            return self._pool
+
+    def _connect(self):
+        """Takes a connection from the pool if one is not already held and open."""
+        if self._connection is None or self._connection.closed:
+            try:
+                if self._connection is not None:
+                    # drop the broken connection instead of handing it out again
+                    self._pool.putconn(self._connection, close=True)
+                    self._connection = None
+                self._connection = self._get_pool().getconn()
+                # Transactions are managed manually, queries outside begin()/commit()
+                # are committed one by one by _execute_query.
+                self._connection.autocommit = False
                 print("Connection established successfully.")
             except Error as e:
                 print(f"Error connecting to database: {e}")
@@ -48,11 +148,55 @@ class DBConnector:
         return self._connection
 
     def _close(self):
-        """Closes the database connection if it's open."""
-        if self._connection and not self._connection.closed:
-            self._connection.close()
-            print("Connection closed.")
+        """Returns the connection to the pool, or closes it if it is not pooled."""
+        if self._connection is not None:
+            if self._pool is not None and not self._pool.closed:
+                self._pool.putconn(self._connection, close=self._connection.closed)
+                print("Connection returned to pool.")
+            elif not self._connection.closed:
+                self._connection.close()
+                print("Connection closed.")
         self._connection = None  # Ensure connection is None after closing
+        self._in_transaction = False
+
+    def _discard_connection(self):
+        """Closes the held connection, the next query takes a new one from the pool."""
+        if self._connection is not None:
+            if self._pool is not None and not self._pool.closed:
+                self._pool.putconn(self._connection, close=True)
+            else:
+                self._connection.close()
+        self._connection = None
+
+    def close_pool(self):
+        """
+        Closes all pooled connections, only the connector which created the pool does so.
+        """
+        self._close()
+        if self._owns_pool and self._pool is not None and not self._pool.closed:
+            self._pool.closeall()
+            print("Connection pool closed.")
+        self._pool = None
+        self._owns_pool = False
+
+    def begin(self):
+        """
+        Starts a transaction, queries are not committed until commit() is called.
+        """
+        self._connect()
+        self._in_transaction = True
+
+    def commit(self):
+        """Commits the current transaction."""
+        if self._connection and not self._connection.closed:
+            self._connection.commit()
+        self._in_transaction = False
+
+    def rollback(self):
+        """Rolls back the current transaction."""
+        if self._connection and not self._connection.closed:
+            self._connection.rollback()
+        self._in_transaction = False
 
     # Context Manager methods for 'with' statement support
     def __enter__(self):
@@ -60,33 +204,61 @@ class DBConnector:
         return self._connect()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Called when exiting the 'with' statement. Ensures connection is closed."""
-        self._close()
+        """Called when exiting the 'with' statement. Ensures connections are closed."""
+        self.close_pool()
 
     def _execute_query(self, query: str, params=None):
         """
         Executes a SQL query with optional parameters.
         Manages cursor creation and closing.
+        The query is committed right away unless it runs inside begin()/commit(),
+        in which case errors are re-raised so the caller can roll back.
+        Outside a transaction, a lost connection is replaced and the query retried.
 
         Return:
             fetched data for SELECT queries.
         """
-        try:
-            with self._connect().cursor() as cursor:
-                cursor.execute(query, params)
-        except Error as e:
-            print(f"Error executing query: {e}")
+        for attempt in range(QUERY_ATTEMPTS):
+            try:
+                with self._connect().cursor() as cursor:
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall() if cursor.description is not None else None
+                if not self._in_transaction:
+                    self._connection.commit()
+                return rows
+            except Error as e:
+                # a transaction cannot be resumed on another connection
+                if (
+                    isinstance(e, OperationalError)
+                    and not self._in_transaction
+                    and attempt < QUERY_ATTEMPTS - 1
+                ):
+                    print(f"Connection error executing query, retrying: {e}")
+                    self._discard_connection()
+                    time.sleep(QUERY_RETRY_DELAY * 2**attempt)
+                    continue
+                print(f"Error executing query: {e}")
+                if self._in_transaction:
+                    raise
+                if self._connection and not self._connection.closed:
+                    self._connection.rollback()
+                return None
 
     # --- Database-specific functions using DBConnector ---
 
     def init_db(self):
         """
         Re-initiate DB, delete currencies schema and public.item_prices table 
+        Drops and creates run in a single transaction.
         """
+        self.begin()
         try:
             self._execute_query("DROP SCHEMA IF EXISTS currency CASCADE")
             self._execute_query("DROP TABLE IF EXISTS public.item_prices CASCADE")
-            self._execute_query("DROP View IF EXISTS public.item_prices_NOK CASCADE")
+            self._execute_query(
+                "DROP MATERIALIZED VIEW IF EXISTS public.item_prices_NOK CASCADE"
+            )
+            self._execute_query("DROP TABLE IF EXISTS public.ingest_check_point")
         except Error as e:
             print(f"Error when dropping existing SCHEMA, TABLE, or View: {e}")
         except Exception as e:
@@ -98,6 +270,8 @@ class DBConnector:
         self.create_currencies_table()
         self.create_currency_conversion_rate_table()
         self.create_item_prices_table()
+        self.create_check_point_table()
+        self.commit()
 
     def create_currencies_table(self):
         """
@@ -145,6 +319,9 @@ class DBConnector:
         FOREIGN KEY (target_currency_code) REFERENCES currency.currencies(currency_code)
         );
 
+        -- serves the latest-rate-before-date lookup of the item_prices_NOK view
+        CREATE INDEX IF NOT EXISTS ccr_target_date_idx
+        ON currency.currency_conversion_rate (target_currency_code, date DESC);
         """
         try:
             self._execute_query(POSTGRES_CREATE_TABLE_SQL)
@@ -168,7 +345,7 @@ class DBConnector:
         id   VARCHAR(100) PRIMARY KEY,
         item  VARCHAR(100),
         price  NUMERIC(5,2),
-        currency VARCHAR(3),
+        currency VARCHAR(3) CONSTRAINT currency_len3 CHECK (char_length(currency) = 3),
         created_at TIMESTAMPTZ,
         updated_at TIMESTAMPTZ,
         system_timestamp TIMESTAMPTZ,
@@ -187,46 +364,168 @@ class DBConnector:
         except Exception as e:
             print(f"An unexpected error occurred during table creation: {e}")
 
-    def upsert_record_item_prices(
-        self, id, item, price, currency, created_at, updated_at, system_timestamp
-    ):
+    def create_check_point_table(self):
         """
-        Upserts a record into the public.item_prices table.
-        Takes a DBConnector instance to perform the operation.
+        Creates the public.ingest_check_point table if it doesn't exist.
+        It keeps the latest ingested system_timestamp so reruns skip processed data.
+        """
+        POSTGRES_CREATE_TABLE_SQL = """
+        CREATE TABLE IF NOT EXISTS public.ingest_check_point (
+        name         VARCHAR(100) PRIMARY KEY,
+        check_point  TIMESTAMPTZ NOT NULL
+            );
         """
-        if len(currency) != 3:
+        try:
+            self._execute_query(POSTGRES_CREATE_TABLE_SQL)
             print(
-                "currency(code) invalid for upsert in item_prices, it should be 3 characters."
+                "public.ingest_check_point table is created (or already existed) as requested."
             )
-            return False
+        except Error as e:
+            print(f"Error creating public.ingest_check_point table: {e}")
+        except Exception as e:
+            print(f"An unexpected error occurred during table creation: {e}")
+
+    def get_check_point(self, name: str):
+        """
+        Reads a saved check point from the public.ingest_check_point table.
+
+        Return:
+            datetime: the saved check point, or None if there is none
+        """
+        rows = self._execute_query(
+            "SELECT check_point FROM public.ingest_check_point WHERE name = %s",
+            (name,),
+        )
+        if rows:
+            return rows[0][0]
+        return None
 
+    def save_check_point(self, name: str, check_point):
+        """
+        Upserts a check point into the public.ingest_check_point table.
+        """
         upsert_sql = """
-        INSERT INTO public.item_prices (id, item, price, currency, created_at, updated_at, system_timestamp)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (id) DO UPDATE
-        SET
-            item = EXCLUDED.item,
-            price = EXCLUDED.price,
-            currency = EXCLUDED.currency,
-            created_at = EXCLUDED.created_at,
-            updated_at = EXCLUDED.updated_at,
-            system_timestamp = EXCLUDED.system_timestamp;
+        INSERT INTO public.ingest_check_point (name, check_point)
+        VALUES (%s, %s)
+        ON CONFLICT (name) DO UPDATE
+        SET check_point = EXCLUDED.check_point;
+        """
+        try:
+            self._execute_query(upsert_sql, (name, check_point))
+        except Error as e:
+            print(f"An error occurred when saving check point {name}: {e}")
+        except Exception as e:
+            print(f"An unexpected error occurred when saving check point {name}: {e}")
+
+    def upsert_record_item_prices(
+        self, id, item, price, currency, created_at, updated_at, system_timestamp
+    ):
+        """
+        Upserts a record into the public.item_prices table.
+        Takes a DBConnector instance to perform the operation.
+        Invalid currency codes are rejected by the table's constraints.
         """
         params = (id, item, price, currency, created_at, updated_at, system_timestamp)
 
         try:
-            self._execute_query(upsert_sql, params)
+            self.upsert_record_item_prices_batch([params])
         except Error as e:
             print(f"An error occurred during upsert for ID {id}: {e}")
         except Exception as e:
             print(f"An unexpected error occurred during upsert for ID {id}: {e}")
 
+    def upsert_record_item_prices_batch(self, rows, page_size=1000):
+        """
+        Upserts a list of row tuples, ordered as ITEM_PRICES_COLUMNS,
+        into the public.item_prices table.
+        Rows are sent as multi-row INSERT ... ON CONFLICT statements of page_size rows,
+        committed here unless begin() was called.
+        """
+        # ON CONFLICT cannot affect the same row twice within one statement,
+        # keep the last occurrence of an id
+        unique_rows = list({row[0]: row for row in rows}.values())
+        if not unique_rows:
+            return
+
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                execute_values(
+                    cursor, UPSERT_ITEM_PRICES_SQL, unique_rows, page_size=page_size
+                )
+            if not self._in_transaction:
+                connection.commit()
+        except Error as e:
+            print(f"An error occurred during batch upsert into public.item_prices: {e}")
+            if not self._in_transaction and not connection.closed:
+                connection.rollback()
+            raise
+
+    def bulk_upsert_item_prices(self, item_prices_df):
+        """
+        Upserts a batch of records into the public.item_prices table.
+        Rows are streamed with COPY into a temporary staging table which is then
+        merged into public.item_prices with a single INSERT ... ON CONFLICT,
+        all within one transaction, committed here unless begin() was called.
+
+        Return:
+            Integer: number of rows inserted/updated
+        """
+        # ON CONFLICT cannot affect the same row twice within one statement,
+        # keep the last occurrence of an id as the per-row upsert did
+        staged_df = item_prices_df[list(ITEM_PRICES_COLUMNS)].drop_duplicates(
+            subset=["id"], keep="last"
+        )
+        if staged_df.empty:
+            return 0
+
+        buffer = io.StringIO()
+        staged_df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(CREATE_ITEM_PRICES_STAGE_SQL)
+                cursor.copy_expert(COPY_ITEM_PRICES_STAGE_SQL, buffer)
+                cursor.execute(MERGE_ITEM_PRICES_STAGE_SQL)
+                rows_affected = cursor.rowcount
+            if not self._in_transaction:
+                connection.commit()
+        except Error as e:
+            print(f"An error occurred during bulk upsert into public.item_prices: {e}")
+            if not self._in_transaction and not connection.closed:
+                connection.rollback()
+            raise
+        return rows_affected
+
     def create_item_prices_NOK_view(self):
         """
-        Create a view converting item_prices converting prices to NOK according to exchange rate
+        Create a materialized view converting item_prices converting prices to NOK according to exchange rate
+        The join is computed once here and on refresh_item_prices_NOK_view, not on every read
+        A plain view of the same name left by earlier versions is replaced.
+
+        Return:
+            Boolean: True if the view was created with fresh data and needs no refresh
+        """
+        exists_sql = """
+            select 1 from pg_matviews
+            where schemaname = 'public' and matviewname = 'item_prices_nok'
+        """
+        # DROP VIEW IF EXISTS fails on a materialized view, so check the kind first
+        drop_plain_view_sql = """
+            do $$
+            begin
+                if exists (
+                    select 1 from pg_views
+                    where schemaname = 'public' and viewname = 'item_prices_nok'
+                ) then
+                    drop view public.item_prices_nok;
+                end if;
+            end $$;
         """
         sql = """
-            create view public.item_prices_nok as (
+            create materialized view public.item_prices_nok as (
             select p.id, p.item, p.price/cc.rate as price,'NOK' as currency,
             p.created_at, p.updated_at,p.system_timestamp from public.item_prices as p
             left join lateral 
@@ -238,13 +537,46 @@ class DBConnector:
                 limit 1
             )
             as cc on true)
+            with data;
+
+            -- required to refresh the view concurrently
+            create unique index if not exists item_prices_nok_id_idx
+            on public.item_prices_nok (id);
         """
         try:
+            self.begin()
+            if self._execute_query(exists_sql):
+                self.commit()
+                print("public.item_prices_NOK view already exists")
+                return False
+            self._execute_query(drop_plain_view_sql)
             self._execute_query(sql)
+            self.commit()
             print("public.item_prices_NOK view created successfully ")
+            return True
         except Error as e:
+            self.rollback()
             print(f"An error when creating VIEW public.item_prices_NOK: {e}")
         except Exception as e:
+            self.rollback()
             print(
                 f"An unexpected error occurred during creating VIEW public.item_prices_NOK: {e}"
             )
+        return False
+
+    def refresh_item_prices_NOK_view(self):
+        """
+        Refresh the public.item_prices_NOK materialized view with the latest prices and rates
+        Runs concurrently so the view stays readable during the refresh
+        """
+        try:
+            self._execute_query(
+                "REFRESH MATERIALIZED VIEW CONCURRENTLY public.item_prices_nok"
+            )
+            print("public.item_prices_NOK view refreshed successfully ")
+        except Error as e:
+            print(f"An error when refreshing VIEW public.item_prices_NOK: {e}")
+        except Exception as e:
+            print(
+                f"An unexpected error occurred during refreshing VIEW public.item_prices_NOK: {e}"
+            )
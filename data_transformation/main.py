@@ -25,6 +25,7 @@ def init():
     if os.getenv("REINIT_DB") == "TRUE":
         # Task 1.1: create required Tables in DB
         db_connector.init_db()
+    db_connector.create_check_point_table()
 
     return db_connector
 
@@ -43,7 +44,13 @@ def main():
         f"{os.getenv('DB_PASSWORD')}@"
         f"{os.getenv('DB_HOST')}:"
         f"{os.getenv('DB_PORT')}/"
-        f"{os.getenv('DB_NAME')}"
+        f"{os.getenv('DB_NAME')}",
+        # batch executemany into multi-row VALUES / execute_batch pages
+        executemany_mode="values_plus_batch",
+        insertmanyvalues_page_size=1000,
+        executemany_batch_page_size=1000,
+        pool_size=8,
+        pool_pre_ping=True,
     )
 
     # Task1.2: Populate currency.currencies Table
@@ -53,17 +60,20 @@ def main():
 
     # Task2.1: proces csv files
     csv_processor = CsvProcessor(db_connector=db_connector)
+    csv_processor.load_check_point()
     list_of_dates = csv_processor.process_csvs()
 
     # Task2.2: reads currency conversion rates of the above dates and put them in DB
-    for date in list_of_dates:
-        rates_df = api_processor.process_hist_rate_NOK(date)
+    # dates are independent, so they are fetched concurrently and upserted once
+    rates_df = api_processor.process_hist_rate_NOK_many(list_of_dates)
+    if not rates_df.empty:
         upsert_rates_to_db(rates_df=rates_df, db_engine=db_engine)
 
-    # Task3 create SQL view
-    db_connector.create_item_prices_NOK_view()
+    # Task3 create SQL view, or refresh it with the data loaded above if it existed
+    if not db_connector.create_item_prices_NOK_view():
+        db_connector.refresh_item_prices_NOK_view()
 
-    db_connector._close()
+    db_connector.close_pool()
 
 
 if __name__ == "__main__":
@@ -1,14 +1,99 @@
 import pytest
-from data_transformation.api_processor import APIProcessor
+from data_transformation.api_processor import (
+    APIProcessor,
+    HIST_RATES_EXPIRE_AFTER,
+    LATEST_RATES_EXPIRE_AFTER,
+    _cast_if_needed,
+    _db_upsert_record_currencies_user_method,
+    upsert_rates_to_db,
+)
 import requests
 import pandas as pd
 import unittest
+import datetime
+from types import SimpleNamespace
+from sqlalchemy import Column, MetaData, String, Table
+from sqlalchemy.dialects import postgresql
 
 # --- Pytest Fixture ---
 @pytest.fixture
-def api_processor():
+def api_processor(tmp_path):
     """Provides a fresh APIProcessor instance for each test."""
-    return APIProcessor(base_url="http://mockapi.com")
+    return APIProcessor(
+        base_url="http://mockapi.com", cache_name=str(tmp_path / "http_cache")
+    )
+
+
+def test_make_request_expire_after(api_processor, mocker):
+    """Test historical rates are cached longer than latest rates."""
+    mock_get = mocker.patch.object(api_processor.session, "get")
+    mock_get.return_value.content = b'{"rates": {}}'
+
+    api_processor._get_historical_rate("2023-01-15")
+    api_processor._get_base_rate("nok")
+
+    mock_get.assert_any_call(
+        "http://mockapi.com/rates",
+        params={"date": "2023-01-15"},
+        expire_after=HIST_RATES_EXPIRE_AFTER,
+        timeout=10,
+    )
+    mock_get.assert_any_call(
+        "http://mockapi.com/rates",
+        params={"base": "NOK"},
+        expire_after=LATEST_RATES_EXPIRE_AFTER,
+        timeout=10,
+    )
+
+
+@pytest.mark.parametrize("days_ahead", [0, 1])
+def test_historical_rate_not_past_expires_early(api_processor, mocker, days_ahead):
+    """Test rates of today or later dates are cached like latest rates."""
+    mock_get = mocker.patch.object(api_processor.session, "get")
+    mock_get.return_value.content = b'{"rates": {}}'
+    date = (
+        datetime.datetime.now(datetime.timezone.utc).date()
+        + datetime.timedelta(days=days_ahead)
+    ).isoformat()
+
+    api_processor._get_historical_rate(date)
+
+    mock_get.assert_called_once_with(
+        "http://mockapi.com/rates",
+        params={"date": date},
+        expire_after=LATEST_RATES_EXPIRE_AFTER,
+        timeout=10,
+    )
+
+
+def test_latest_data_memoized(api_processor, mocker):
+    """Test currencies and base rates are only requested once per processor."""
+    mock_get = mocker.patch.object(api_processor.session, "get")
+    mock_get.return_value.content = b'{"rates": {}}'
+
+    api_processor._get_currencies()
+    api_processor._get_currencies()
+    api_processor._get_base_rate("nok")
+    api_processor._get_base_rate("NOK")
+    api_processor._get_base_rate("USD")
+
+    assert mock_get.call_count == 3
+
+
+def test_make_request_invalid_json(api_processor, mocker, capsys):
+    """Test a response that is not valid JSON is reported and returns None."""
+    mock_get = mocker.patch.object(api_processor.session, "get")
+    mock_get.return_value.content = b"<html>Bad Gateway</html>"
+
+    assert api_processor._get_currencies() is None
+    assert "Error decoding response" in capsys.readouterr().out
+
+
+def test_session_connection_pool(api_processor):
+    """Test the session reuses pooled connections and retries failed calls."""
+    adapter = api_processor.session.get_adapter("https://api.vatcomply.com")
+    assert adapter._pool_maxsize == 16
+    assert adapter.max_retries.total == 3
 
 
 def test_process_currencies_duplicate(api_processor, mocker):
@@ -50,6 +135,19 @@ def test_process_currencies_duplicate(api_processor, mocker):
     )
 
 
+def test_cast_if_needed(mocker):
+    """Test _cast_if_needed only casts columns which do not have the dtype yet."""
+    df = pd.DataFrame({"code": ["USD", "EUR"], "number": [1, 2], "rate": [1.5, 2.5]})
+    astype_spy = mocker.spy(pd.Series, "astype")
+
+    _cast_if_needed(df, "code", str)
+    _cast_if_needed(df, "number", str)
+    _cast_if_needed(df, "rate", "float64")
+
+    astype_spy.assert_called_once()
+    assert df["number"].tolist() == ["1", "2"]
+
+
 def test_process_base_rates_success_duplicate(api_processor, mocker):
     """Test process_base_rates with successful API response."""
     mocker.patch.object(
@@ -152,17 +250,15 @@ def test_process_hist_rates_success_duplicates(api_processor, mocker):
 
 def test_process_hist_rate_NOK_success(api_processor, mocker):
     """Test process_hist_rate_NOK with successful historical rates."""
-    # Mock the output of process_hist_rates (which returns EUR-based rates)
+    # Mock the API response of historical rates (which are EUR-based)
     mocker.patch.object(
         api_processor,
-        "process_hist_rates",
-        return_value=pd.DataFrame(
-            {
-                "currency_code": ["USD", "EUR", "NOK", "GBP"],
-                "rate_EUR": [1.08, 1.00, 10.00, 0.85],  # NOK rate is 10.00
-                "date": ["2023-03-01"] * 4,
-            }
-        ),
+        "_get_historical_rate",
+        return_value={
+            "date": "2023-03-01",
+            "base": "EUR",
+            "rates": {"USD": 1.08, "EUR": 1.00, "NOK": 10.00, "GBP": 0.85},
+        },  # NOK rate is 10.00
     )
 
     df = api_processor.process_hist_rate_NOK("2023-03-01")
@@ -189,3 +285,161 @@ def test_process_hist_rate_NOK_success(api_processor, mocker):
         df.sort_values("target_currency_code").reset_index(drop=True),
         expected_df.sort_values("target_currency_code").reset_index(drop=True),
     )
+
+
+def test_db_upsert_record_currencies_user_method(mocker):
+    """Test currencies are upserted with one executemany call of bound rows."""
+    currencies_table = Table(
+        "currencies",
+        MetaData(),
+        Column("currency_code", String(3), primary_key=True),
+        Column("name", String(100)),
+        Column("symbol", String(10)),
+        schema="currency",
+    )
+    mock_conn = mocker.MagicMock()
+    mock_conn.execute.return_value.rowcount = 2
+    keys = ["currency_code", "name", "symbol"]
+    data_iter = iter([("USD", "US Dollar", "$"), ("EUR", "Euro", "€")])
+
+    rows_affected = _db_upsert_record_currencies_user_method(
+        SimpleNamespace(table=currencies_table), mock_conn, keys, data_iter
+    )
+
+    assert rows_affected == 2
+    mock_conn.execute.assert_called_once()
+    stmt, values = mock_conn.execute.call_args.args
+    assert values == [
+        {"currency_code": "USD", "name": "US Dollar", "symbol": "$"},
+        {"currency_code": "EUR", "name": "Euro", "symbol": "€"},
+    ]
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (currency_code) DO UPDATE" in sql
+    # rows are bound as parameters, not inlined into the statement
+    assert "US Dollar" not in sql
+
+
+def test_upsert_rates_to_db(mocker):
+    """Test rates are copied into a staging table and merged with one statement."""
+    mock_engine = mocker.MagicMock()
+    mock_conn = mock_engine.begin.return_value.__enter__.return_value
+    mock_cursor = mock_conn.connection.cursor.return_value.__enter__.return_value
+    rates_df = pd.DataFrame(
+        {
+            "target_currency_code": ["USD", "EUR"],
+            "date": ["2023-03-01"] * 2,
+            "base_currency_code": ["NOK"] * 2,
+            "rate": [0.108, 0.1],
+        }
+    )
+
+    upsert_rates_to_db(rates_df=rates_df, db_engine=mock_engine)
+
+    mock_cursor.copy_expert.assert_called_once()
+    copy_sql, buffer = mock_cursor.copy_expert.call_args.args
+    assert "COPY pg_temp.currency_conversion_rate_stage" in copy_sql
+    assert buffer.getvalue().splitlines() == [
+        "2023-03-01,NOK,USD,0.108",
+        "2023-03-01,NOK,EUR,0.1",
+    ]
+    assert mock_cursor.execute.call_count == 2
+    assert "ON CONFLICT (date, base_currency_code, target_currency_code)" in (
+        mock_cursor.execute.call_args.args[0]
+    )
+
+
+def test_process_hist_rates_many(api_processor, mocker):
+    """Test process_hist_rates_many combines the rates of several dates."""
+    responses = {
+        "2023-03-03": {
+            "date": "2023-03-03",
+            "base": "EUR",
+            "rates": {"USD": 1.08, "NOK": 10.00},
+        },
+        # weekend resolves to the previous rate date
+        "2023-03-04": {
+            "date": "2023-03-03",
+            "base": "EUR",
+            "rates": {"USD": 1.08, "NOK": 10.00},
+        },
+        "2023-03-06": {
+            "date": "2023-03-06",
+            "base": "EUR",
+            "rates": {"USD": 1.10},
+        },
+    }
+    mock_get = mocker.patch.object(
+        api_processor, "_get_historical_rate", side_effect=responses.get
+    )
+
+    df = api_processor.process_hist_rates_many(list(responses))
+
+    assert mock_get.call_count == 3
+    expected_df = pd.DataFrame(
+        {
+            "currency_code": ["USD", "NOK", "USD"],
+            "rate_EUR": [1.08, 10.00, 1.10],
+            "date": ["2023-03-03", "2023-03-03", "2023-03-06"],
+        }
+    )
+    pd.testing.assert_frame_equal(df, expected_df, check_dtype=False)
+
+
+def test_process_hist_rate_NOK_many(api_processor, mocker):
+    """Test process_hist_rate_NOK_many rebases rates of several dates at once."""
+    responses = {
+        "2023-03-03": {
+            "date": "2023-03-03",
+            "base": "EUR",
+            "rates": {"USD": 1.08, "NOK": 10.00, "GBP": 0.85},
+        },
+        # weekend resolves to the previous rate date
+        "2023-03-04": {
+            "date": "2023-03-03",
+            "base": "EUR",
+            "rates": {"USD": 1.08, "NOK": 10.00, "GBP": 0.85},
+        },
+        "2023-03-06": {
+            "date": "2023-03-06",
+            "base": "EUR",
+            "rates": {"USD": 1.10, "NOK": 11.00},
+        },
+    }
+    mocker.patch.object(
+        api_processor, "_get_historical_rate", side_effect=responses.get
+    )
+
+    df = api_processor.process_hist_rate_NOK_many(list(responses))
+
+    assert df.columns.tolist() == [
+        "target_currency_code",
+        "date",
+        "base_currency_code",
+        "rate",
+    ]
+    expected_df = pd.DataFrame(
+        {
+            "target_currency_code": ["GBP", "NOK", "USD", "NOK", "USD"],
+            "date": ["2023-03-03"] * 3 + ["2023-03-06"] * 2,
+            "base_currency_code": ["NOK"] * 5,
+            "rate": [0.085, 1.0, 0.108, 1.0, 0.1],
+        }
+    )
+    pd.testing.assert_frame_equal(
+        df.sort_values(["date", "target_currency_code"]).reset_index(drop=True),
+        expected_df,
+        check_dtype=False,
+    )
+
+
+def test_process_hist_rate_NOK_many_no_dates(api_processor):
+    """Test process_hist_rate_NOK_many returns an empty dataframe without dates."""
+    df = api_processor.process_hist_rate_NOK_many([])
+
+    assert df.empty
+    assert df.columns.tolist() == [
+        "target_currency_code",
+        "date",
+        "base_currency_code",
+        "rate",
+    ]
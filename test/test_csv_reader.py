@@ -1,17 +1,20 @@
 import pytest
 import os
+import io
 import pandas as pd
+import pyarrow.csv as pacsv
 import datetime
 from datetime import timezone
+from types import SimpleNamespace
 from unittest.mock import MagicMock
 from data_transformation.csv_reader import CsvProcessor
 
 
 @pytest.fixture
 def mock_db_connector():
-    """Provides a mock database connector with a mock upsert method."""
+    """Provides a mock database connector whose spawned connectors have a mock bulk upsert method."""
     connector = MagicMock()
-    connector.upsert_record_item_prices = MagicMock()
+    connector.spawn.return_value.bulk_upsert_item_prices = MagicMock()
     return connector
 
 
@@ -29,6 +32,30 @@ def csv_processor(mock_db_connector, mocker):
     return processor
 
 
+def mock_scandir(mocker, filenames):
+    """Mocks os.scandir to list the given regular files."""
+    entries = [
+        SimpleNamespace(name=filename, is_file=lambda: True) for filename in filenames
+    ]
+    mock = mocker.patch("os.scandir")
+    mock.return_value.__enter__.return_value = iter(entries)
+    return mock
+
+
+def mock_read_csv_files(mocker, csv_contents):
+    """
+    Mocks pyarrow.csv.read_csv to parse the dataframe mapped to the read path.
+    Files are read concurrently, so contents are mapped by path instead of call order.
+    """
+    real_read_csv = pacsv.read_csv
+    return mocker.patch(
+        "pyarrow.csv.read_csv",
+        side_effect=lambda path, **kwargs: real_read_csv(
+            io.BytesIO(csv_contents[path].to_csv(index=False).encode()), **kwargs
+        ),
+    )
+
+
 def test_get_batch_number_valid(csv_processor):
     """Test _get_batch_number with valid filenames."""
     assert csv_processor._get_batch_number("batch1.csv") == 1
@@ -45,10 +72,10 @@ def test_get_batch_number_invalid(csv_processor):
 
 
 def test_order_csvs(csv_processor, mocker):
-    """Test _order_csvs to ensure correct sorting and filtering."""
-    mock_listdir = mocker.patch(
-        "os.listdir",
-        return_value=["batch3.csv", "batch1.csv", "other_file.csv", "batch2.csv",],
+    """Test _order_csvs to ensure correct sorting and filtering of non-csv files."""
+    mock_scandir(
+        mocker,
+        ["batch3.csv", "batch1.csv", "other_file.csv", "notes.txt", "batch2.csv"],
     )
     # Set a predictable batch_data_dir in the mock object
     csv_processor.batch_data_dir = "/mock/batch/data"
@@ -60,7 +87,7 @@ def test_order_csvs(csv_processor, mocker):
 def test_process_csvs_basic_flow(csv_processor, mocker):
     """Test basic processing with some new and some old rows."""
     # Mock file system and CSV content
-    mocker.patch("os.listdir", return_value=["batch1.csv", "batch2.csv"])
+    mock_scandir(mocker, ["batch1.csv", "batch2.csv"])
     mocker.patch(
         "os.path.join", side_effect=lambda a, b: f"{a}/{b}"
     )  # Mock join for predictable paths
@@ -105,8 +132,12 @@ def test_process_csvs_basic_flow(csv_processor, mocker):
         }
     )
 
-    # Configure mock_read_csv to return different DataFrames for different files
-    mock_read_csv = mocker.patch("pandas.read_csv", side_effect=[df1, df2])
+    # Configure mock_read_csv to parse different DataFrames for different files
+    csv_contents = {
+        "/mock/batch_data/batch1.csv": df1,
+        "/mock/batch_data/batch2.csv": df2,
+    }
+    mock_read_csv = mock_read_csv_files(mocker, csv_contents)
 
     # Set initial checkpoint to filter out some rows
     csv_processor.check_point = datetime.datetime(
@@ -117,39 +148,32 @@ def test_process_csvs_basic_flow(csv_processor, mocker):
     returned_dates = csv_processor.process_csvs()
 
     # Assertions
-    # upsert_record_item_prices should be called only for rows after the checkpoint
+    # bulk_upsert_item_prices should be called once per file with only the rows after the checkpoint
     # Row 3 from df1, Row 4, 5 from df2
-    assert csv_processor.db_connector.upsert_record_item_prices.call_count == 3
-
-    # Check calls for df1 (row 3, id=3)
-    csv_processor.db_connector.upsert_record_item_prices.assert_any_call(
-        3,
-        "C",
-        30.0,
-        "GBP",
-        pd.Timestamp("2023-01-01 12:00:00+0000", tz="UTC"),
-        pd.Timestamp("2023-01-01 12:00:00+0000", tz="UTC"),
-        pd.Timestamp("2023-01-01 12:00:00+0000", tz="UTC"),
-    )
-    # Check calls for df2 (rows 4, 5)
-    csv_processor.db_connector.upsert_record_item_prices.assert_any_call(
-        4,
-        "D",
-        40.0,
-        "JPY",
-        pd.Timestamp("2023-01-01 13:00:00+0000", tz="UTC"),
-        pd.Timestamp("2023-01-01 13:00:00+0000", tz="UTC"),
-        pd.Timestamp("2023-01-01 13:00:00+0000", tz="UTC"),
+    # each file is upserted through its own connector, in any order
+    bulk_upsert = csv_processor.db_connector.spawn.return_value.bulk_upsert_item_prices
+    assert bulk_upsert.call_count == 2
+    upserted_df1, upserted_df2 = sorted(
+        (call.args[0] for call in bulk_upsert.call_args_list),
+        key=lambda df: df["id"].iloc[0],
     )
-    csv_processor.db_connector.upsert_record_item_prices.assert_any_call(
-        5,
-        "E",
-        50.0,
-        "AUD",
-        pd.Timestamp("2023-01-01 14:00:00+0000", tz="UTC"),
-        pd.Timestamp("2023-01-01 14:00:00+0000", tz="UTC"),
-        pd.Timestamp("2023-01-01 14:00:00+0000", tz="UTC"),
+
+    # Check rows for df1 (row 3, id=3)
+    assert upserted_df1["id"].tolist() == ["3"]
+    assert upserted_df1.iloc[0]["item"] == "C"
+    assert upserted_df1.iloc[0]["price"] == 30.0
+    assert upserted_df1.iloc[0]["currency"] == "GBP"
+    assert upserted_df1.iloc[0]["system_timestamp"] == pd.Timestamp(
+        "2023-01-01 12:00:00+0000", tz="UTC"
     )
+    # Check rows for df2 (rows 4, 5)
+    assert upserted_df2["id"].tolist() == ["4", "5"]
+    assert upserted_df2["currency"].tolist() == ["JPY", "AUD"]
+    assert isinstance(upserted_df2["currency"].dtype, pd.CategoricalDtype)
+    assert upserted_df2["updated_at"].tolist() == [
+        pd.Timestamp("2023-01-01 13:00:00+0000", tz="UTC"),
+        pd.Timestamp("2023-01-01 14:00:00+0000", tz="UTC"),
+    ]
 
     # Verify final checkpoint
     assert csv_processor.check_point == pd.Timestamp(
@@ -161,3 +185,219 @@ def test_process_csvs_basic_flow(csv_processor, mocker):
     assert sorted(returned_dates) == sorted(
         expected_dates
     )  # Use sorted for list comparison
+
+    # Verify the final checkpoint is saved
+    csv_processor.db_connector.save_check_point.assert_called_once_with(
+        "item_prices", csv_processor.check_point
+    )
+
+
+def test_process_csvs_skips_old_files(csv_processor, mocker):
+    """Test files without rows newer than the checkpoint are never fully read."""
+    mock_scandir(mocker, ["batch1.csv", "batch2.csv"])
+    csv_processor.batch_data_dir = "/mock/batch_data"
+    df_old = pd.DataFrame(
+        {
+            "id": [1],
+            "item": ["A"],
+            "price": [10.0],
+            "currency": ["USD"],
+            "created_at": ["2023-01-01T10:00:00Z"],
+            "updated_at": ["2023-01-01T10:00:00Z"],
+            "system_timestamp": ["2023-01-01T10:00:00Z"],
+        }
+    )
+    df_new = df_old.assign(
+        id=[2],
+        updated_at=["2023-01-02T10:00:00Z"],
+        system_timestamp=["2023-01-02T10:00:00Z"],
+    )
+    csv_contents = {
+        "/mock/batch_data/batch1.csv": df_old,
+        "/mock/batch_data/batch2.csv": df_new,
+    }
+    mock_read_csv = mock_read_csv_files(mocker, csv_contents)
+    csv_processor.check_point = datetime.datetime(2023, 1, 1, 12, tzinfo=timezone.utc)
+
+    returned_dates = csv_processor.process_csvs()
+
+    # both files are peeked, only batch2 is read in full
+    read_paths = [call.args[0] for call in mock_read_csv.call_args_list]
+    assert sorted(read_paths) == [
+        "/mock/batch_data/batch1.csv",
+        "/mock/batch_data/batch2.csv",
+        "/mock/batch_data/batch2.csv",
+    ]
+    bulk_upsert = csv_processor.db_connector.spawn.return_value.bulk_upsert_item_prices
+    assert bulk_upsert.call_count == 1
+    assert bulk_upsert.call_args.args[0]["id"].tolist() == ["2"]
+    # dates of skipped files are still returned
+    assert returned_dates == [datetime.date(2023, 1, 1), datetime.date(2023, 1, 2)]
+
+
+def test_process_csvs_skips_file_without_system_timestamp(csv_processor, mocker):
+    """Test a file with an empty system_timestamp column does not filter later files."""
+    mock_scandir(mocker, ["batch1.csv", "batch2.csv"])
+    csv_processor.batch_data_dir = "/mock/batch_data"
+    df_new = pd.DataFrame(
+        {
+            "id": [2],
+            "item": ["B"],
+            "price": [20.0],
+            "currency": ["USD"],
+            "created_at": ["2023-01-02T10:00:00Z"],
+            "updated_at": ["2023-01-02T10:00:00Z"],
+            "system_timestamp": ["2023-01-02T10:00:00Z"],
+        }
+    )
+    df_empty_timestamp = df_new.assign(id=[1], system_timestamp=[None])
+    mock_read_csv_files(
+        mocker,
+        {
+            "/mock/batch_data/batch1.csv": df_empty_timestamp,
+            "/mock/batch_data/batch2.csv": df_new,
+        },
+    )
+
+    csv_processor.process_csvs()
+
+    bulk_upsert = csv_processor.db_connector.spawn.return_value.bulk_upsert_item_prices
+    assert bulk_upsert.call_count == 1
+    assert bulk_upsert.call_args.args[0]["id"].tolist() == ["2"]
+    assert csv_processor.check_point == pd.Timestamp("2023-01-02 10:00", tz="UTC")
+
+
+def test_process_csvs_naive_timestamps(csv_processor, mocker):
+    """Test timestamps without a zone offset are read as UTC."""
+    mock_scandir(mocker, ["batch1.csv"])
+    csv_processor.batch_data_dir = "/mock/batch_data"
+    df_naive = pd.DataFrame(
+        {
+            "id": [1, 2],
+            "item": ["A", "B"],
+            "price": [10.0, 20.0],
+            "currency": ["USD", "EUR"],
+            "created_at": ["2025-03-01T08:00:00", "2025-03-01T09:00:00+01:00"],
+            "updated_at": ["2025-03-01T08:00:00", "2025-03-01T09:00:00+01:00"],
+            "system_timestamp": ["2025-03-01T08:00:00", "2025-03-01T09:30:00"],
+        }
+    )
+    mock_read_csv_files(mocker, {"/mock/batch_data/batch1.csv": df_naive})
+
+    returned_dates = csv_processor.process_csvs()
+
+    bulk_upsert = csv_processor.db_connector.spawn.return_value.bulk_upsert_item_prices
+    upserted_df = bulk_upsert.call_args.args[0]
+    assert upserted_df["updated_at"].tolist() == [
+        pd.Timestamp("2025-03-01 08:00", tz="UTC"),
+        pd.Timestamp("2025-03-01 08:00", tz="UTC"),
+    ]
+    assert upserted_df["price"].tolist() == [10.0, 20.0]
+    assert csv_processor.check_point == pd.Timestamp("2025-03-01 09:30", tz="UTC")
+    assert returned_dates == [datetime.date(2025, 3, 1)]
+    csv_processor.db_connector.save_check_point.assert_called_once()
+
+
+def test_process_csvs_failed_file_keeps_check_point(csv_processor, mocker):
+    """Test a file which fails to upsert is processed again by the next run."""
+    mock_scandir(mocker, ["batch1.csv", "batch2.csv", "batch3.csv"])
+    csv_processor.batch_data_dir = "/mock/batch_data"
+    csv_contents = {
+        f"/mock/batch_data/batch{i}.csv": pd.DataFrame(
+            {
+                "id": [i],
+                "item": ["A"],
+                "price": [10.0],
+                "currency": ["USD"],
+                "created_at": [f"2023-01-0{i}T10:00:00Z"],
+                "updated_at": [f"2023-01-0{i}T10:00:00Z"],
+                "system_timestamp": [f"2023-01-0{i}T10:00:00Z"],
+            }
+        )
+        for i in (1, 2, 3)
+    }
+    mock_read_csv_files(mocker, csv_contents)
+
+    def bulk_upsert(df):
+        if df["id"].iloc[0] == "1":
+            raise Exception("merge failed")
+
+    spawned = csv_processor.db_connector.spawn.return_value
+    spawned.bulk_upsert_item_prices.side_effect = bulk_upsert
+    initial_check_point = csv_processor.check_point
+
+    csv_processor.process_csvs()
+
+    assert spawned.bulk_upsert_item_prices.call_count == 3
+    spawned.rollback.assert_called_once()
+    # batch2 and batch3 succeeded, but batch1 must not be skipped by the next run
+    assert csv_processor.check_point == initial_check_point
+    csv_processor.db_connector.save_check_point.assert_called_once_with(
+        "item_prices", initial_check_point
+    )
+
+
+def test_process_csvs_unreadable_file_keeps_check_point(csv_processor, mocker):
+    """Test a file which only fails its full parse is processed again by the next run."""
+    mock_scandir(mocker, ["batch1.csv", "batch2.csv"])
+    csv_processor.batch_data_dir = "/mock/batch_data"
+    df_new = pd.DataFrame(
+        {
+            "id": [2],
+            "item": ["B"],
+            "price": [20.0],
+            "currency": ["USD"],
+            "created_at": ["2023-01-02T10:00:00Z"],
+            "updated_at": ["2023-01-02T10:00:00Z"],
+            "system_timestamp": ["2023-01-02T10:00:00Z"],
+        }
+    )
+    df_bad_price = df_new.assign(
+        id=[1],
+        price=["abc"],
+        updated_at=["2023-01-01T10:00:00Z"],
+        system_timestamp=["2023-01-01T10:00:00Z"],
+    )
+    mock_read_csv_files(
+        mocker,
+        {
+            "/mock/batch_data/batch1.csv": df_bad_price,
+            "/mock/batch_data/batch2.csv": df_new,
+        },
+    )
+    initial_check_point = csv_processor.check_point
+
+    csv_processor.process_csvs()
+
+    bulk_upsert = csv_processor.db_connector.spawn.return_value.bulk_upsert_item_prices
+    assert bulk_upsert.call_count == 1
+    assert bulk_upsert.call_args.args[0]["id"].tolist() == ["2"]
+    csv_processor.db_connector.save_check_point.assert_called_once_with(
+        "item_prices", initial_check_point
+    )
+
+
+def test_load_check_point(csv_processor):
+    """Test the checkpoint saved by a previous run is restored."""
+    saved = datetime.datetime(
+        2023, 1, 1, 13, tzinfo=timezone(datetime.timedelta(hours=1))
+    )
+    csv_processor.db_connector.get_check_point.return_value = saved
+
+    csv_processor.load_check_point()
+
+    csv_processor.db_connector.get_check_point.assert_called_once_with("item_prices")
+    assert csv_processor.check_point == saved
+    assert csv_processor.check_point == pd.Timestamp("2023-01-01 12:00:00", tz="UTC")
+    assert str(csv_processor.check_point.tz) == "UTC"
+
+
+def test_load_check_point_none(csv_processor):
+    """Test the initial checkpoint is kept when none was saved."""
+    csv_processor.db_connector.get_check_point.return_value = None
+
+    csv_processor.load_check_point()
+
+    assert csv_processor.check_point == datetime.datetime(
+        1970, 1, 1, tzinfo=timezone.utc
+    )
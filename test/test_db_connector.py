@@ -1,9 +1,10 @@
 import pytest
 import os
 import psycopg2
-from psycopg2 import Error
+import pandas as pd
+from psycopg2 import Error, OperationalError
 from unittest.mock import MagicMock, patch
-from data_transformation.db_connector import DBConnector
+from data_transformation.db_connector import DBConnector, QUERY_ATTEMPTS
 
 # --- Pytest Fixtures ---
 @pytest.fixture
@@ -70,6 +71,50 @@ def test_init_custom_params(db_connector_custom):
     assert db_connector_custom._connection is None
 
 
+def test_spawn(db_connector_custom, mock_psycopg2_connect):
+    spawned = db_connector_custom.spawn()
+    assert spawned is not db_connector_custom
+    assert spawned.dbname == "test_db"
+    assert spawned.user == "test_user"
+    assert spawned.password == "test_password"
+    assert spawned.host == "test_host"
+    assert spawned.port == "1234"
+    assert spawned._connection is None
+    # spawned connectors share the pool without owning it
+    assert spawned._pool is db_connector_custom._pool
+    assert spawned._owns_pool is False
+
+
+# Test connection pooling
+def test_connection_reused_across_queries(db_connector_default, mock_psycopg2_connect):
+    db_connector_default._execute_query("SELECT 1;")
+    db_connector_default._execute_query("SELECT 2;")
+
+    psycopg2.connect.assert_called_once()
+    assert db_connector_default._connection is mock_psycopg2_connect
+
+
+def test_close_pool(db_connector_default, mock_psycopg2_connect):
+    db_connector_default._execute_query("SELECT 1;")
+    pool = db_connector_default._pool
+
+    db_connector_default.close_pool()
+
+    assert pool.closed
+    mock_psycopg2_connect.close.assert_called()
+    assert db_connector_default._pool is None
+    assert db_connector_default._connection is None
+
+
+def test_close_pool_spawned(db_connector_default, mock_psycopg2_connect):
+    spawned = db_connector_default.spawn()
+
+    spawned.close_pool()
+
+    # only the connector that created the pool closes it
+    assert not db_connector_default._pool.closed
+
+
 # Test _close method
 def test_close_connection_open(db_connector_default, mock_psycopg2_connect):
     db_connector_default._connection = mock_psycopg2_connect  # Simulate open connection
@@ -113,6 +158,57 @@ def test_execute_query_success(db_connector_default, mock_psycopg2_connect):
     # mock_cursor.close() is automatically handled by the 'with' statement for cursor
 
 
+def test_execute_query_commits(db_connector_default, mock_psycopg2_connect):
+    db_connector_default._execute_query("SELECT 1;")
+    mock_psycopg2_connect.commit.assert_called_once()
+
+
+def test_execute_query_in_transaction(db_connector_default, mock_psycopg2_connect):
+    db_connector_default.begin()
+    db_connector_default._execute_query("SELECT 1;")
+    db_connector_default._execute_query("SELECT 2;")
+    mock_psycopg2_connect.commit.assert_not_called()
+
+    db_connector_default.commit()
+    mock_psycopg2_connect.commit.assert_called_once()
+    assert db_connector_default._in_transaction is False
+
+
+def test_execute_query_error_in_transaction(
+    db_connector_default, mock_psycopg2_connect
+):
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.execute.side_effect = Error("Query issue")
+    db_connector_default.begin()
+
+    with pytest.raises(Error):
+        db_connector_default._execute_query("SELECT 1;")
+
+    db_connector_default.rollback()
+    mock_psycopg2_connect.rollback.assert_called_once()
+    mock_psycopg2_connect.commit.assert_not_called()
+
+
+def test_get_check_point(db_connector_default, mock_psycopg2_connect):
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.fetchall.return_value = [("2023-01-01 12:00:00+00:00",)]
+
+    check_point = db_connector_default.get_check_point("item_prices")
+
+    assert check_point == "2023-01-01 12:00:00+00:00"
+    mock_cursor.execute.assert_called_once_with(
+        "SELECT check_point FROM public.ingest_check_point WHERE name = %s",
+        ("item_prices",),
+    )
+
+
+def test_get_check_point_missing(db_connector_default, mock_psycopg2_connect):
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.fetchall.return_value = []
+
+    assert db_connector_default.get_check_point("item_prices") is None
+
+
 def test_execute_query_no_params(db_connector_default, mock_psycopg2_connect):
     mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
     query = "CREATE TABLE IF NOT EXISTS my_table (id INT);"
@@ -133,3 +229,169 @@ def test_execute_query_connection_error(db_connector_default, mocker, capsys):
     # No cursor.execute call should happen if connect fails
     mock_conn = mocker.MagicMock()
     mock_conn.cursor.assert_not_called()
+
+
+def test_execute_query_retries_lost_connection(
+    db_connector_default, mock_psycopg2_connect, mocker
+):
+    mock_sleep = mocker.patch("data_transformation.db_connector.time.sleep")
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.execute.side_effect = [OperationalError("Connection lost"), None]
+
+    db_connector_default._execute_query("SELECT 1;")
+
+    assert mock_cursor.execute.call_count == 2
+    # the lost connection is closed and a new one is opened for the retry
+    mock_psycopg2_connect.close.assert_called_once()
+    assert psycopg2.connect.call_count == 2
+    mock_sleep.assert_called_once()
+    mock_psycopg2_connect.commit.assert_called_once()
+
+
+def test_execute_query_no_retry_in_transaction(
+    db_connector_default, mock_psycopg2_connect, mocker
+):
+    mocker.patch("data_transformation.db_connector.time.sleep")
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.execute.side_effect = OperationalError("Connection lost")
+    db_connector_default.begin()
+
+    with pytest.raises(OperationalError):
+        db_connector_default._execute_query("SELECT 1;")
+
+    mock_cursor.execute.assert_called_once()
+
+
+def test_execute_query_gives_up_after_retries(
+    db_connector_default, mock_psycopg2_connect, mocker, capsys
+):
+    mocker.patch("data_transformation.db_connector.time.sleep")
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.execute.side_effect = OperationalError("Connection lost")
+
+    assert db_connector_default._execute_query("SELECT 1;") is None
+
+    assert mock_cursor.execute.call_count == QUERY_ATTEMPTS
+    assert "Error executing query: Connection lost" in capsys.readouterr().out
+
+
+# Test upsert_record_item_prices_batch method
+def test_upsert_record_item_prices_batch(
+    db_connector_default, mock_psycopg2_connect, mocker
+):
+    mock_execute_values = mocker.patch(
+        "data_transformation.db_connector.execute_values"
+    )
+    rows = [
+        ("1", "A", 10.0, "USD", None, None, None),
+        ("1", "A2", 11.0, "USD", None, None, None),
+        ("3", "C", 30.0, "NOK", None, None, None),
+    ]
+
+    db_connector_default.upsert_record_item_prices_batch(rows, page_size=500)
+
+    mock_execute_values.assert_called_once()
+    _, upsert_sql, sent_rows = mock_execute_values.call_args.args
+    assert "VALUES %s" in upsert_sql
+    # an older system_timestamp never overwrites a newer one, as in the COPY merge
+    assert (
+        "public.item_prices.system_timestamp <= EXCLUDED.system_timestamp" in upsert_sql
+    )
+    # duplicated id keeps the last row
+    assert sent_rows == [
+        ("1", "A2", 11.0, "USD", None, None, None),
+        ("3", "C", 30.0, "NOK", None, None, None),
+    ]
+    assert mock_execute_values.call_args.kwargs == {"page_size": 500}
+    mock_psycopg2_connect.commit.assert_called_once()
+
+
+def test_upsert_record_item_prices_uses_batch(db_connector_default, mocker):
+    mock_batch = mocker.patch.object(
+        db_connector_default, "upsert_record_item_prices_batch"
+    )
+
+    db_connector_default.upsert_record_item_prices(
+        "1", "A", 10.0, "USD", None, None, None
+    )
+
+    mock_batch.assert_called_once_with([("1", "A", 10.0, "USD", None, None, None)])
+
+
+# Test bulk_upsert_item_prices method
+def test_bulk_upsert_item_prices(db_connector_default, mock_psycopg2_connect):
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    item_prices_df = pd.DataFrame(
+        {
+            "id": ["1", "2", "1"],
+            "item": ["A", "B", "A2"],
+            "price": [10.0, 20.0, 11.0],
+            "currency": ["USD", "EUR", "USD"],
+            "created_at": ["2023-01-01T10:00:00Z"] * 3,
+            "updated_at": ["2023-01-01T10:00:00Z"] * 3,
+            "system_timestamp": ["2023-01-01T10:00:00Z"] * 3,
+        }
+    )
+
+    db_connector_default.bulk_upsert_item_prices(item_prices_df)
+
+    mock_cursor.copy_expert.assert_called_once()
+    copy_sql, buffer = mock_cursor.copy_expert.call_args.args
+    assert "COPY pg_temp.item_prices_stage" in copy_sql
+    # duplicated id keeps the last row
+    assert buffer.getvalue().splitlines() == [
+        "2,B,20.0,EUR,2023-01-01T10:00:00Z,2023-01-01T10:00:00Z,2023-01-01T10:00:00Z",
+        "1,A2,11.0,USD,2023-01-01T10:00:00Z,2023-01-01T10:00:00Z,2023-01-01T10:00:00Z",
+    ]
+    executed = [call.args[0] for call in mock_cursor.execute.call_args_list]
+    assert "CREATE TEMP TABLE item_prices_stage" in executed[0]
+    assert "ON CONFLICT (id) DO UPDATE" in executed[1]
+    mock_psycopg2_connect.commit.assert_called_once()
+
+
+def test_bulk_upsert_item_prices_error(db_connector_default, mock_psycopg2_connect):
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.copy_expert.side_effect = Error("Copy failed")
+    item_prices_df = pd.DataFrame(
+        {
+            "id": ["1"],
+            "item": ["A"],
+            "price": [10.0],
+            "currency": ["USD"],
+            "created_at": ["2023-01-01T10:00:00Z"],
+            "updated_at": ["2023-01-01T10:00:00Z"],
+            "system_timestamp": ["2023-01-01T10:00:00Z"],
+        }
+    )
+
+    with pytest.raises(Error):
+        db_connector_default.bulk_upsert_item_prices(item_prices_df)
+
+    mock_psycopg2_connect.rollback.assert_called_once()
+    mock_psycopg2_connect.commit.assert_not_called()
+
+
+def test_create_item_prices_NOK_view_replaces_plain_view(
+    db_connector_default, mock_psycopg2_connect
+):
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.fetchall.return_value = []  # no materialized view yet
+
+    assert db_connector_default.create_item_prices_NOK_view() is True
+
+    executed = [call.args[0] for call in mock_cursor.execute.call_args_list]
+    assert "pg_matviews" in executed[0]
+    assert "drop view public.item_prices_nok" in executed[1]
+    assert "create materialized view public.item_prices_nok" in executed[2]
+    mock_psycopg2_connect.commit.assert_called_once()
+
+
+def test_create_item_prices_NOK_view_exists(
+    db_connector_default, mock_psycopg2_connect
+):
+    mock_cursor = mock_psycopg2_connect.cursor.return_value.__enter__.return_value
+    mock_cursor.fetchall.return_value = [(1,)]
+
+    assert db_connector_default.create_item_prices_NOK_view() is False
+
+    mock_cursor.execute.assert_called_once()